@@ -6,19 +6,26 @@ This script was originally based on a library named sunbeam,
 hence the name. Later, this library has been merged into opm-common
 """
 
+import re
 import sys
 import datetime
-import tempfile
 import argparse
 import textwrap
 import logging
 import warnings
+import functools
 import dateutil.parser
 from pathlib import Path
-from typing import List, Union
+from typing import List, Optional, Tuple, Union
 
 import yaml
 
+try:
+    # Use the libyaml C parser when PyYAML has been built with it:
+    from yaml import CSafeLoader as YamlSafeLoader
+except ImportError:
+    from yaml import SafeLoader as YamlSafeLoader  # type: ignore
+
 from opm.tools import TimeVector  # type: ignore
 
 import configsuite  # lgtm [py/import-and-import-from]
@@ -292,13 +299,18 @@ def get_schema() -> dict:
     return CONFIG_SCHEMA_V2
 
 
+@functools.lru_cache(maxsize=4096)
 def datetime_from_date(
     date: Union[str, datetime.datetime, datetime.date]
 ) -> datetime.datetime:
-    """Set time to 00:00:00 in a date"""
+    """Set time to 00:00:00 in a date
+
+    Memoized, as the same dates are converted repeatedly when processing
+    inserts and dategrids. The returned datetime objects are immutable.
+    """
     if isinstance(date, str):
         raise ValueError("Is the string {} a date?".format(str(date)))
-    return datetime.datetime.combine(date, datetime.datetime.min.time())
+    return datetime.datetime(date.year, date.month, date.day)
 
 
 def process_sch_config(conf) -> TimeVector:
@@ -330,13 +342,14 @@ def process_sch_config(conf) -> TimeVector:
 
     if conf.files is not None:
         for filename in conf.files:
-            if sch_file_nonempty(filename):
+            # Both properties are determined from one trial parse of the file:
+            (nonempty, file_starts_with_dates) = _probe_sch_file(filename)
+            if nonempty:
                 logger.info("Loading %s", filename)
             else:
                 logger.warning("No Eclipse statements in %s, skipping", filename)
                 continue
 
-            file_starts_with_dates = sch_file_starts_with_dates_keyword(filename)
             timevector = load_timevector_from_file(
                 filename, conf.startdate, file_starts_with_dates
             )
@@ -347,12 +360,17 @@ def process_sch_config(conf) -> TimeVector:
 
     if conf.insert is not None:
         logger.info("Processing %s insert statements", str(len(conf.insert)))
+        # Anchor for relative inserts, loop invariant:
+        refdatetime = datetime_from_date(conf.refdate)
         for insert_statement in conf.insert:
             logger.debug(str(insert_statement))
 
+            # Substituted templates are kept in memory, not written to disk:
+            deck_string = None
             if insert_statement.substitute and insert_statement.template:
-                filename = substitute(insert_statement)
-                logger.debug("Produced file: %s", str(filename))
+                filename = insert_statement.template
+                deck_string = substitute(insert_statement)
+                logger.debug("Substituted template: %s", str(filename))
             elif insert_statement.template and not insert_statement.substitute:
                 logger.error(
                     "Missing subsitute for template %s", insert_statement.template
@@ -367,9 +385,7 @@ def process_sch_config(conf) -> TimeVector:
             if insert_statement.date:
                 date = datetime_from_date(insert_statement.date)
             elif insert_statement.days:
-                date = datetime_from_date(conf.refdate) + datetime.timedelta(
-                    days=insert_statement.days
-                )
+                date = refdatetime + datetime.timedelta(days=insert_statement.days)
             else:
                 logger.error("Could not determine date for insertion")
                 logger.error("From data: %s", str(insert_statement))
@@ -378,12 +394,14 @@ def process_sch_config(conf) -> TimeVector:
             # Do the insertion:
             if date >= conf.starttime:
                 if insert_statement.string is None:
-                    if sch_file_nonempty(filename):
-                        schedule.load(filename, date=date)
-                    else:
+                    if not _probe_sch_file(filename, deck_string)[0]:
                         logger.warning(
                             "No Eclipse statements in %s, skipping", filename
                         )
+                    elif deck_string is None:
+                        schedule.load(filename, date=date)
+                    else:
+                        schedule.load_string(deck_string, date=date)
                 else:
                     schedule.add_keywords(
                         datetime_from_date(date), [insert_statement.string]
@@ -391,8 +409,12 @@ def process_sch_config(conf) -> TimeVector:
             else:
                 logger.warning("Ignoring inserts before startdate")
 
+    # schedule.dates is a computed property, fetch it and convert it once:
+    schedule_datetimes = schedule.dates
+    schedule_dates = [date.date() for date in schedule_datetimes]
+
     if conf.enddate is None:
-        enddate = schedule.dates[-1].date()
+        enddate = schedule_dates[-1]
     else:
         enddate = conf.enddate  # datetime.date
         if not isinstance(enddate, datetime.date):
@@ -402,22 +424,36 @@ def process_sch_config(conf) -> TimeVector:
                 )
             )
 
-    # Clip anything that is beyond the enddate
-    for date in schedule.dates:
-        if date.date() > enddate:
-            schedule.delete(date)
+    # Clip anything that is beyond the enddate. The dates to delete are
+    # collected first, as schedule.dates is not to be modified while iterated
+    clipped_dates = [
+        date
+        for (date, date_only) in zip(schedule_datetimes, schedule_dates)
+        if date_only > enddate
+    ]
+    for date in clipped_dates:
+        schedule.delete(date)
 
     # Ensure that the end-date is actually mentioned in the Schedule
     # so that we know Eclipse will actually simulate until this date
-    if enddate not in [x.date() for x in schedule.dates]:
+    # (only dates after enddate were clipped, so schedule_dates is still usable)
+    existing_datetimes = set(schedule_datetimes).difference(clipped_dates)
+    if enddate not in set(schedule_dates):
         schedule.add_keywords(datetime_from_date(enddate), [""])
+        existing_datetimes.add(datetime_from_date(enddate))
 
     # Dategrid is added at the end, in order to support
-    # an implicit end-date
+    # an implicit end-date. Dates already in the schedule are skipped.
     if conf.dategrid:
-        dates = dategrid(conf.startdate, enddate, conf.dategrid)
-        for _date in dates:
-            schedule.add_keywords(datetime_from_date(_date), [""])
+        grid_datetimes = [
+            datetime_from_date(date)
+            for date in dategrid(conf.startdate, enddate, conf.dategrid)
+        ]
+        for grid_datetime in grid_datetimes:
+            if grid_datetime not in existing_datetimes:
+                # (TimeVector keeps a reference to the keyword list,
+                # so each date must have its own list)
+                schedule.add_keywords(grid_datetime, [""])
 
     return schedule
 
@@ -438,19 +474,16 @@ def load_timevector_from_file(
     tmpschedule = TimeVector(datetime.date(1900, 1, 1))
     if file_starts_with_dates:
         tmpschedule.load(filename)
-        early_dates = [date for date in tmpschedule.dates if date.date() < startdate]
-        if len(early_dates) > 1:
-            logger.info("Clipping away dates: %s", str(early_dates[1:]))
-            for date in early_dates:
-                tmpschedule.delete(date)
     else:
         tmpschedule.load(filename, datetime_from_date(datetime.date(1900, 1, 1)))
 
-        early_dates = [date for date in tmpschedule.dates if date.date() < startdate]
-        if len(early_dates) > 1:
-            logger.info("Clipping away dates: %s", str(early_dates[1:]))
-            for date in early_dates:
-                tmpschedule.delete(date)
+    # The dates to delete are collected before any deletion, as
+    # tmpschedule.dates is recomputed from the TimeVector on every access
+    early_dates = [date for date in tmpschedule.dates if date.date() < startdate]
+    if len(early_dates) > 1:
+        logger.info("Clipping away dates: %s", str(early_dates[1:]))
+        for date in early_dates:
+            tmpschedule.delete(date)
     return tmpschedule
 
 
@@ -464,14 +497,35 @@ def sch_file_nonempty(filename: str) -> bool:
     Returns:
         bool: False if the file is empty or has only comments.
     """
+    return _probe_sch_file(filename)[0]
+
+
+def _probe_sch_file(
+    filename: str, deck_string: Optional[str] = None
+) -> Tuple[bool, bool]:
+    """Determine if a file (to be included) has any Eclipse keywords
+    at all, and if DATES is its first keyword, from a single parse.
+
+    Args:
+        filename
+        deck_string: If provided, this string is parsed instead of the
+            file contents, and filename is only used in error messages.
+
+    Returns:
+        tuple of two bools, the first is False if the file is empty or has
+        only comments, the second is True if the first keyword is DATES.
+    """
     # Implementation is by trial and error:
     try:
         tmpschedule = TimeVector(datetime.date(1900, 1, 1))
-        tmpschedule.load(filename)
+        if deck_string is None:
+            tmpschedule.load(filename)
+        else:
+            tmpschedule.load_string(deck_string)
     except IndexError as err:
         if "Keyword index 0 is out of range" in str(err):
             # This is what we get from opm for empty files.
-            return False
+            return (False, False)
 
         # Try to workaround a non-explanatory error from opm-common:
         if "map::at" in str(err):
@@ -490,8 +544,8 @@ def sch_file_nonempty(filename: str) -> bool:
     except ValueError:
         # This is where we get for files not starting with DATES,
         # but that means it is nonempty
-        return True
-    return True
+        return (True, False)
+    return (True, True)
 
 
 def sch_file_starts_with_dates_keyword(filename: str) -> bool:
@@ -521,11 +575,8 @@ def sch_file_starts_with_dates_keyword(filename: str) -> bool:
 
 def substitute(insert_statement) -> str:
     """
-    Perform key-value substitutions and generate the result
-    as a file on disk.
-
-    It is more natural to return a string, but this is to be used
-    in opm.tools.TimeVector which initializes with a filename.
+    Perform key-value substitutions and return the result as a string,
+    to be loaded into a opm.tools.TimeVector with load_string().
 
     Template parameters for which there are no values provided will
     be left untouched.
@@ -537,7 +588,7 @@ def substitute(insert_statement) -> str:
             to be used.
 
     Returns:
-        str: Filename on temporary location for immediate use
+        str: The template contents with values substituted
     """
 
     if len([key for key in list(insert_statement) if key is not None]) > 3:
@@ -546,20 +597,20 @@ def substitute(insert_statement) -> str:
             "Too many (?) configuration elements in %s", str(insert_statement)
         )
 
-    resultfile = tempfile.NamedTemporaryFile(mode="w", delete=False)
-    resultfilename = resultfile.name
-    templatelines = open(insert_statement.template, "r").readlines()
+    template = Path(insert_statement.template).read_text()
 
-    # Parse substitution list:
-    substdict = insert_statement.substitute
-    # Perform substitution and put into a tmp file
-    for line in templatelines:
-        for (key, value) in substdict:
-            if "<" + key + ">" in line:
-                line = line.replace("<" + key + ">", str(value))
-        resultfile.write(line)
-    resultfile.close()
-    return resultfilename
+    # Parse substitution list into a tag-to-value mapping:
+    replacements = {
+        "<" + key + ">": str(value) for (key, value) in insert_statement.substitute
+    }
+
+    # Perform substitution on the whole template in one pass, independent
+    # of the number of keys. A template without any "<" has no tags,
+    # and compiling and scanning is skipped.
+    if replacements and "<" in template:
+        tag_pattern = re.compile("|".join(map(re.escape, replacements)))
+        template = tag_pattern.sub(lambda match: replacements[match.group(0)], template)
+    return template
 
 
 def wrap_long_lines(string: str, maxchars: int = 128, warn: bool = True) -> str:
@@ -621,16 +672,16 @@ def _remap_v1_insert_to_v2(insert_statement: dict) -> dict:
     if "substitute" in insert_statement and not insert_statement["substitute"]:
         del insert_statement["substitute"]
 
-    fileid = list(insert_statement.keys())[0]
+    fileid = next(iter(insert_statement))
 
     if len(insert_statement) > 1:
         logger.warning(
             "This does not look like v1 insert config element %s", str(insert_statement)
         )
 
-    filedata = list(insert_statement[fileid].keys())
+    filedata = insert_statement[fileid]
     # v1 config property:
-    if not isinstance(insert_statement[fileid], dict):
+    if not isinstance(filedata, dict):
         logger.error("BUG: The insert_statement: %s was not v1", str(insert_statement))
         return {}
 
@@ -643,16 +694,16 @@ def _remap_v1_insert_to_v2(insert_statement: dict) -> dict:
         if "filename" not in filedata:
             filename = fileid
         else:
-            filename = insert_statement[fileid]["filename"]
+            filename = filedata["filename"]
         v2_insert_statement.update({"filename": filename})
 
-    if "substitute" in insert_statement[fileid]:
+    if "substitute" in filedata:
         v2_insert_statement.update({"template": filename})
         if "filename" in v2_insert_statement:
             v2_insert_statement.pop("filename")
-    if "filename" in insert_statement[fileid]:
-        insert_statement[fileid].pop("filename")
-    v2_insert_statement.update(insert_statement[fileid])
+    if "filename" in filedata:
+        filedata.pop("filename")
+    v2_insert_statement.update(filedata)
     if "substitute" not in v2_insert_statement:
         v2_insert_statement["substitute"] = {}
     # Ensure the string transformation is applied
@@ -671,7 +722,7 @@ def dategrid(
     Args:
         startdate: First date in range
         enddate: Last date in range
-        interval: Must be among: 'monthly', 'yearly', 'weekly',
+        interval: Must be among: 'daily', 'monthly', 'yearly', 'weekly',
             'biweekly', 'bimonthly'
 
     Return:
@@ -686,32 +737,42 @@ def dategrid(
             + ", ".join(SUPPORTED_DATEGRIDS)
         )
     dates = [startdate]
-    date = startdate + datetime.timedelta(days=1)
-    startdateweekday = startdate.weekday()
-
-    # Brute force implementation by looping over all possible
-    # days. This is robust with respect to all possible date oddities,
-    # but makes it difficult to support more interval types.
-    while date <= enddate:
-        if interval == "monthly":
-            if date.day == 1:
-                dates.append(date)
-        elif interval == "bimonthly":
-            if date.day == 1 and date.month % 2 == 1:
-                dates.append(date)
-        elif interval == "weekly":
-            if date.weekday() == startdateweekday:
-                dates.append(date)
-        elif interval == "biweekly":
-            weeknumber = date.isocalendar()[1]
-            if date.weekday() == startdateweekday and weeknumber % 2 == 1:
-                dates.append(date)
-        elif interval == "yearly":
-            if date.day == 1 and date.month == 1:
+
+    if interval in ("daily", "weekly", "biweekly"):
+        # Step directly between the candidate dates, the first candidate
+        # is the day after startdate or the same weekday a week later:
+        step = datetime.timedelta(days=1 if interval == "daily" else 7)
+        # biweekly only picks odd ISO week numbers, which is not the
+        # same as stepping 14 days across years with 53 weeks.
+        odd_weeks_only = interval == "biweekly"
+        date = startdate + step
+        while date <= enddate:
+            if not odd_weeks_only or date.isocalendar()[1] % 2 == 1:
                 dates.append(date)
-        elif interval == "daily":
-            dates.append(date)
-        date += datetime.timedelta(days=1)
+            date += step
+        return dates
+
+    if interval == "yearly":
+        dates.extend(
+            datetime.date(year, 1, 1)
+            for year in range(startdate.year + 1, enddate.year + 1)
+        )
+        return dates
+
+    # monthly or bimonthly, always at the first day of a month. Months
+    # are enumerated from year zero with January as 0 to make the
+    # arithmetic linear, starting at the month after startdate:
+    month_step = 1 if interval == "monthly" else 2
+    month_idx = startdate.year * 12 + startdate.month
+    if interval == "bimonthly" and month_idx % 2 == 1:
+        # Only odd months (January, March, ..) are included
+        month_idx += 1
+    while month_idx // 12 <= enddate.year:
+        date = datetime.date(month_idx // 12, month_idx % 12 + 1, 1)
+        if date > enddate:
+            break
+        dates.append(date)
+        month_idx += month_step
     return dates
 
 
@@ -816,7 +877,8 @@ def main():
     defaults_config = {"output": "-", "startdate": datetime.date(1900, 1, 1)}
 
     # Users YAML configuration:
-    yaml_config = yaml.safe_load(open(args.config))
+    with open(args.config, "rb") as f_handle:
+        yaml_config = yaml.load(f_handle, Loader=YamlSafeLoader)
 
     # Command line configuration:
     cli_config = {}
@@ -847,27 +909,19 @@ def main():
         config_schema_v2_pure = CONFIG_SCHEMA_V2.copy()
         # Check if yaml had outdated v1 syntax, check that by removing the
         # transformation key(s) in the top layer from configsuite:
-        # pylint: disable=consider-iterating-dictionary
         trans_keys = [
-            key
-            for key in CONFIG_SCHEMA_V2.keys()
-            if str(key) == "MetaKeys.Transformation"
+            key for key in CONFIG_SCHEMA_V2 if str(key) == "MetaKeys.Transformation"
         ]
         for deletekey in trans_keys:
             del config_schema_v2_pure[deletekey]
 
-        try:
-            config_pure = configsuite.ConfigSuite(
-                {},
-                config_schema_v2_pure,
-                layers=(defaults_config, yaml_config, cli_config),
-                deduce_required=True,
-            )
-            valid = config_pure.valid
-        except KeyError:
-            # Only Py2 gets here.
-            valid = False
-        if not valid:
+        config_pure = configsuite.ConfigSuite(
+            {},
+            config_schema_v2_pure,
+            layers=(defaults_config, yaml_config, cli_config),
+            deduce_required=True,
+        )
+        if not config_pure.valid:
             logger.error(
                 (
                     "Your configuration syntax is UNSUPPORTED, "
@@ -893,13 +947,14 @@ def main():
     if args.debug and config.snapshot.output != __MAGIC_STDOUT__:
         logger.setLevel(logging.DEBUG)
 
-    # Generate the schedule section, as a string:
+    # Generate the schedule section, as a string. Serializing the TimeVector
+    # is the most expensive step, and is done only once here:
     schedule = wrap_long_lines(
         str(process_sch_config(config.snapshot)), maxchars=128, warn=True
     )
 
     if config.snapshot.output == __MAGIC_STDOUT__:
-        print(schedule)
+        sys.stdout.write(schedule + "\n")
     else:
         logger.info("Writing Eclipse deck to %s", str(config.snapshot.output))
         dirname = Path(config.snapshot.output).parent
@@ -581,19 +581,23 @@ def test_merge(readonly_datadir):
 
 def test_sch_file_nonempty(tmpdir):
     """Test that we can detect empty files"""
+    # pylint: disable=protected-access
     tmpdir.chdir()
 
     Path("empty.sch").write_text("")
     assert not sunsch.sch_file_nonempty("empty.sch")
+    assert sunsch._probe_sch_file("empty.sch") == (False, False)
 
     Path("commentonly.sch").write_text("-- an Eclipse comment")
     assert not sunsch.sch_file_nonempty("commentonly.sch")
 
     Path("dates.sch").write_text("DATES\n 1 NOV 2080 / \n/")
     assert sunsch.sch_file_nonempty("dates.sch")
+    assert sunsch._probe_sch_file("dates.sch") == (True, True)
 
     Path("wconprod.sch").write_text("WCONPROD\n A ORAT 0 / \n/")
     assert sunsch.sch_file_nonempty("wconprod.sch")
+    assert sunsch._probe_sch_file("wconprod.sch") == (True, False)
 
     Path("bogus.sch").write_text("BOGUSrn A ORAT 0 / \n/")
     # Such a bogus file will give errors later, but
@@ -726,6 +730,65 @@ def test_dategrid():
         )
 
 
+@pytest.mark.parametrize(
+    "startdate, enddate, interval, expected",
+    [
+        (
+            datetime.date(2020, 1, 15),
+            datetime.date(2020, 4, 1),
+            "monthly",
+            [
+                datetime.date(2020, 1, 15),
+                datetime.date(2020, 2, 1),
+                datetime.date(2020, 3, 1),
+                datetime.date(2020, 4, 1),
+            ],
+        ),
+        (
+            datetime.date(2020, 11, 15),
+            datetime.date(2021, 4, 1),
+            "bimonthly",
+            [
+                datetime.date(2020, 11, 15),
+                datetime.date(2021, 1, 1),
+                datetime.date(2021, 3, 1),
+            ],
+        ),
+        (
+            datetime.date(2020, 6, 1),
+            datetime.date(2022, 12, 31),
+            "yearly",
+            [
+                datetime.date(2020, 6, 1),
+                datetime.date(2021, 1, 1),
+                datetime.date(2022, 1, 1),
+            ],
+        ),
+        (
+            datetime.date(2020, 1, 1),
+            datetime.date(2020, 1, 1),
+            "daily",
+            [datetime.date(2020, 1, 1)],
+        ),
+        (
+            # 2020 has 53 ISO weeks, week 53 and week 1 are both odd:
+            datetime.date(2020, 12, 16),
+            datetime.date(2021, 1, 20),
+            "biweekly",
+            [
+                datetime.date(2020, 12, 16),
+                datetime.date(2020, 12, 30),
+                datetime.date(2021, 1, 6),
+                datetime.date(2021, 1, 20),
+            ],
+        ),
+    ],
+)
+def test_dategrid_function(startdate, enddate, interval, expected):
+    """Test the dategrid function directly, at month and year boundaries"""
+    assert sunsch.dategrid(startdate, enddate, interval) == expected
+
+
 def test_wrap_long_lines():
     """Test that lines that are excessively long gets wrapped.
 